@@ -1,15 +1,26 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timezone, date, timedelta
 from collections import defaultdict
 import pandas as pd
+import numpy as np
 import json
 import time
 import openpyxl
 from openpyxl.styles import Alignment, PatternFill, Font, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
 import io
 import os
+import threading
+import hashlib
+import itertools
+import functools
+import diskcache
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 st.set_page_config(page_title="OKR Scoring System", page_icon="📊", layout="wide")
 
@@ -56,6 +67,30 @@ GOAL_ACCESS_TOKEN = os.getenv("GOAL_ACCESS_TOKEN")
 ACCOUNT_ACCESS_TOKEN = os.getenv("ACCOUNT_ACCESS_TOKEN")
 GOOGLE_SHEETS_API_URL = os.getenv("GOOGLE_SHEETS_API_URL")
 
+# Number of pages requested concurrently per paginated endpoint
+FETCH_WORKERS = 8
+
+# OKR movement buckets: <10, 10-25, 26-30, 31-50, 51-80, 81-99, >=100
+MOVEMENT_EDGES = np.array([10, 26, 31, 51, 81, 100])
+MOVEMENT_SCORES = np.array([0.15, 0.25, 0.5, 0.75, 1.25, 1.5, 2.5])
+MOVEMENT_ROWS = np.arange(7, 14)  # Excel rows showing each bucket's score
+
+# Shared HTTP session so connections to Base.vn and Google Sheets are kept alive and reused
+REQUEST_TIMEOUT = 30
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+
+# On-disk cache of API responses so they survive app restarts
+CACHE_TTL = 3600
+DISK_CACHE = diskcache.Cache(".okr_cache")
+
+# Results table and Excel bytes are cached across sessions, so keep only a few recent calculations
+RESULT_CACHE_MAX_ENTRIES = 10
+
 # Helper function to get current quarter start date
 def get_current_quarter_start():
     """Get the first day of the first month of the current quarter"""
@@ -74,26 +109,58 @@ def get_current_quarter_start():
     
     return date(today.year, quarter_start_month, 1)
 
+# Thread pool whose workers share the Streamlit script context, so st.* calls work inside them
+def create_executor(max_workers):
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    )
+
+# Cache an API helper's successful responses on disk, keyed by endpoint name, token hash and arguments
+def disk_cached(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(access_token, *args, **kwargs):
+            token_hash = hashlib.blake2b(str(access_token).encode()).hexdigest()[:16]
+            key = (name, token_hash) + args + tuple(sorted(kwargs.items()))
+            
+            data = DISK_CACHE.get(key)
+            if data is None:
+                data = func(access_token, *args, **kwargs)
+                # Do not cache failed requests
+                if data and not (isinstance(data, dict) and "error" in data):
+                    DISK_CACHE.set(key, data, expire=CACHE_TTL)
+            return data
+        return wrapper
+    return decorator
+
 # Cache functions to improve performance
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=CACHE_TTL)
+@disk_cached("get_cycle_list")
 def get_cycle_list(access_token):
     url = "https://goal.base.vn/extapi/v1/cycle/list"
     payload = {'access_token': access_token}
     
     try:
-        response = requests.post(url, data=payload)
+        response = SESSION.post(url, data=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         
-        # Filter quarterly cycles and convert start time
+        # Filter quarterly cycles and convert all start times at once
+        cycles = [cycle for cycle in data.get('cycles', []) if cycle.get('metatype') == 'quarterly']
+        start_times = pd.to_datetime(
+            pd.to_numeric([cycle['start_time'] for cycle in cycles]), unit='s', utc=True
+        ).to_pydatetime()
+        
         quarterly_cycles = [
             {
                 'name': cycle['name'], 
                 'path': cycle['path'], 
-                'start_time': datetime.fromtimestamp(float(cycle['start_time']), tz=timezone.utc),
-                'formatted_start_time': datetime.fromtimestamp(float(cycle['start_time']), tz=timezone.utc).strftime('%d/%m/%Y')
+                'start_time': start_time,
+                'formatted_start_time': start_time.strftime('%d/%m/%Y')
             } 
-            for cycle in data.get('cycles', []) if cycle.get('metatype') == 'quarterly'
+            for cycle, start_time in zip(cycles, start_times)
         ]
         
         # Sort cycles by start time in descending order (most recent first)
@@ -104,7 +171,8 @@ def get_cycle_list(access_token):
         st.error(f"Error fetching cycle list: {e}")
         return []
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=CACHE_TTL)
+@disk_cached("get_account")
 def get_account(access_token):
     url = f"https://account.base.vn/extapi/v1/users"
     data = {
@@ -112,7 +180,7 @@ def get_account(access_token):
     }
 
     try:
-        response = requests.post(url, data=data)
+        response = SESSION.post(url, data=data, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # Check for HTTP errors
 
         json_response = response.json()
@@ -125,7 +193,8 @@ def get_account(access_token):
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=CACHE_TTL)
+@disk_cached("get_checkins")
 def get_checkins(access_token, path, page, domain="base.vn"):
     url = f"https://goal.{domain}/extapi/v1/cycle/checkins"
     data = {
@@ -135,7 +204,7 @@ def get_checkins(access_token, path, page, domain="base.vn"):
     }
 
     try:
-        response = requests.post(url, data=data)
+        response = SESSION.post(url, data=data, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # Check for HTTP errors
 
         json_response = response.json()
@@ -148,7 +217,8 @@ def get_checkins(access_token, path, page, domain="base.vn"):
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=CACHE_TTL)
+@disk_cached("get_krs")
 def get_krs(access_token, path, page, domain="base.vn"):
     url = f"https://goal.base.vn/extapi/v1/cycle/krs"
     data = {
@@ -158,7 +228,7 @@ def get_krs(access_token, path, page, domain="base.vn"):
     }
 
     try:
-        response = requests.post(url, data=data)
+        response = SESSION.post(url, data=data, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # Check for HTTP errors
 
         json_response = response.json()
@@ -171,7 +241,8 @@ def get_krs(access_token, path, page, domain="base.vn"):
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=CACHE_TTL)
+@disk_cached("get_cycle_data")
 def get_cycle_data(access_token, path):
     url = "https://goal.base.vn/extapi/v1/cycle/get.full"
     payload = {
@@ -180,18 +251,81 @@ def get_cycle_data(access_token, path):
     }
     
     try:
-        response = requests.post(url, data=payload)
+        response = SESSION.post(url, data=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching cycle data: {e}")
         return {}
 
+# Number of pages reported by the first page of a paginated endpoint, None if the response does not say
+# (only unambiguous fields are trusted, otherwise pages are probed until an empty one)
+def get_page_count(response_data):
+    if str(response_data.get("total_pages", "")).isdigit():
+        return int(response_data["total_pages"])
+    
+    if response_data.get("has_more") is False:
+        return 1
+    
+    return None
+
+# Collect page items in order, returns (finished, error) where finished means an empty page or error was hit
+def collect_pages(responses, key, pages):
+    for response_data in responses:
+        if "error" in response_data:
+            return True, response_data["error"]
+        
+        items = response_data.get(key, [])
+        
+        if not items:
+            return True, None
+        
+        pages.append(items)
+    
+    return False, None
+
+# Fetch every page of a paginated endpoint concurrently
+def fetch_all_pages(fetch_page, access_token, path, key):
+    """Return (items, error) collected from all pages of a paginated endpoint."""
+    fetch = lambda page: fetch_page(access_token, path, page)
+    
+    first_page = fetch(1)
+    pages = []
+    finished, error = collect_pages([first_page], key, pages)
+    
+    if not finished:
+        page_count = get_page_count(first_page)
+        
+        with create_executor(FETCH_WORKERS) as executor:
+            if page_count is not None:
+                # Page count is known: fetch all remaining pages at once
+                finished, error = collect_pages(executor.map(fetch, range(2, page_count + 1)), key, pages)
+            else:
+                # Otherwise fetch FETCH_WORKERS pages at a time until an empty page is returned
+                start_page = 2
+                while not finished:
+                    batch = range(start_page, start_page + FETCH_WORKERS)
+                    finished, error = collect_pages(executor.map(fetch, batch), key, pages)
+                    start_page += FETCH_WORKERS
+    
+    return list(itertools.chain.from_iterable(pages)), error
+
 # Fetch all data for a specific cycle
 def fetch_all_data(cycle_path):
     with st.spinner('Fetching data...'):
-        # Fetch account data
-        account_response = get_account(ACCOUNT_ACCESS_TOKEN)
+        # Fetch account, checkins, KRs and cycle data concurrently
+        with create_executor(4) as executor:
+            account_future = executor.submit(get_account, ACCOUNT_ACCESS_TOKEN)
+            checkins_future = executor.submit(fetch_all_pages, get_checkins, GOAL_ACCESS_TOKEN, cycle_path, "checkins")
+            krs_future = executor.submit(fetch_all_pages, get_krs, GOAL_ACCESS_TOKEN, cycle_path, "krs")
+            cycle_future = executor.submit(get_cycle_data, GOAL_ACCESS_TOKEN, cycle_path)
+            
+            account_response = account_future.result()
+            all_checkins, checkins_error = checkins_future.result()
+            all_krs, krs_error = krs_future.result()
+            cycle_data = cycle_future.result()
+        
+        # Process account data
         if "error" in account_response:
             st.error(f"Error fetching account data: {account_response['error']}")
             return None, None, None, None
@@ -201,58 +335,27 @@ def fetch_all_data(cycle_path):
         else:
             account_df = pd.DataFrame([account_response])
             
-        # Fetch checkins data
-        all_checkins = []
-        page = 1
-        while True:
-            response_data = get_checkins(GOAL_ACCESS_TOKEN, cycle_path, page)
-            
-            if "error" in response_data:
-                st.error(f"Error fetching checkins: {response_data['error']}")
-                break
-                
-            checkins = response_data.get("checkins", [])
-            
-            if not checkins:
-                break
-                
-            all_checkins.extend(checkins)
-            page += 1
+        # Process checkins data
+        if checkins_error:
+            st.error(f"Error fetching checkins: {checkins_error}")
             
         checkin_df = pd.DataFrame(all_checkins)
         
-        # Fetch KRs data
-        all_krs = []
-        page = 1
-        while True:
-            response_data = get_krs(GOAL_ACCESS_TOKEN, cycle_path, page)
-            
-            if "error" in response_data:
-                st.error(f"Error fetching KRs: {response_data['error']}")
-                break
-                
-            krs_list = response_data.get("krs", [])
-            
-            if not krs_list:
-                break
-                
-            all_krs.extend(krs_list)
-            page += 1
+        # Process KRs data
+        if krs_error:
+            st.error(f"Error fetching KRs: {krs_error}")
             
         krs_df = pd.DataFrame(all_krs)
         
-        # Fetch cycle data
-        cycle_data = get_cycle_data(GOAL_ACCESS_TOKEN, cycle_path)
-        
         # Process cycle data
         cycle_df = pd.DataFrame()
         if "targets" in cycle_data:
-            targets_list = []
-            for target in cycle_data["targets"]:
-                if "cached_objs" in target:
-                    for obj in target["cached_objs"]:
-                        if isinstance(obj, dict):
-                            targets_list.append(obj)
+            targets_list = [
+                obj
+                for target in cycle_data["targets"]
+                for obj in target.get("cached_objs", [])
+                if isinstance(obj, dict)
+            ]
             
             if targets_list:
                 cycle_df = pd.DataFrame(targets_list)
@@ -261,6 +364,9 @@ def fetch_all_data(cycle_path):
 
 # Define User class for OKR tracking
 class User:
+    __slots__ = ('user_id', 'name', 'co_OKR', 'checkin', 'dich_chuyen_OKR', 'score',
+                 'movement_score', 'movement_row', 'OKR')
+
     def __init__(self, user_id, name, co_OKR=1, checkin=0, dich_chuyen_OKR=0, score=0):
         """Initialize a user with basic attributes."""
         self.user_id = str(user_id)
@@ -269,43 +375,13 @@ class User:
         self.checkin = checkin
         self.dich_chuyen_OKR = dich_chuyen_OKR
         self.score = score
-        self.OKR = {month: 0 for month in range(1, 13)}  # Create OKR dict for months 1-12
+        self.movement_score = None  # Movement bucket score, set by UserManager.calculate_scores
+        self.movement_row = None  # Excel row of the movement bucket, set by UserManager.calculate_scores
+        self.OKR = np.zeros(12, dtype=np.float32)  # OKR values for months 1-12 (index month - 1)
 
     def update_okr(self, month, value):
         if 1 <= month <= 12:
-            self.OKR[month] = value
-
-    def calculate_score(self):
-        """Calculate score based on criteria: check-in, OKR and OKR movement."""
-        score = 0.5
-
-        # Check-in contributes 1 point
-        if self.checkin == 1:
-            score += 0.5
-
-        # Having OKR contributes 1 point
-        if self.co_OKR == 1:
-            score += 1
-
-        # OKR movement score
-        movement = self.dich_chuyen_OKR
-
-        if movement < 10:
-            score += 0.15
-        elif 10 <= movement < 25:
-            score += 0.25
-        elif 26 <= movement < 30:
-            score += 0.5
-        elif 31 <= movement < 50:
-            score += 0.75
-        elif 51 <= movement < 80:
-            score += 1.25
-        elif 81 <= movement < 99:
-            score += 1.5
-        elif movement >= 100:
-            score += 2.5
-
-        self.score = round(score, 2)  # Round to 2 decimal places
+            self.OKR[month - 1] = value
 
     def __repr__(self):
         return (f"User(id={self.user_id}, name={self.name}, co_OKR={self.co_OKR}, "
@@ -317,15 +393,28 @@ class UserManager:
     def __init__(self, account_df, krs_df, checkin_df, cycle_df=None):
         """Initialize UserManager, load data from dataframes."""
         self.account_df = account_df
-        self.krs_df = krs_df
-        self.checkin_df = checkin_df
         self.cycle_df = cycle_df
 
+        # Index KRs and check-ins by user_id (cast to str once) for grouping by user
+        if not krs_df.empty and 'user_id' in krs_df.columns:
+            self.krs_df = krs_df.assign(user_id=krs_df['user_id'].astype(str)).set_index('user_id')
+        else:
+            self.krs_df = pd.DataFrame(index=pd.Index([], name='user_id', dtype=str))
+
+        if not checkin_df.empty and 'user_id' in checkin_df.columns and 'day' in checkin_df.columns:
+            day = pd.to_numeric(checkin_df['day'], errors='coerce')
+            self.checkin_df = checkin_df.assign(
+                user_id=checkin_df['user_id'].astype(str),
+                day=day,
+                checkin_time=pd.to_datetime(day, unit='s', utc=True)
+            ).set_index('user_id')
+        else:
+            self.checkin_df = pd.DataFrame(columns=['day', 'checkin_time'], index=pd.Index([], name='user_id', dtype=str))
+
         # Create user_id → name mapping from account_df
         self.user_name_map = {}
         if not account_df.empty and 'id' in account_df.columns and 'name' in account_df.columns:
-            for _, row in account_df.iterrows():
-                self.user_name_map[str(row['id'])] = row.get('name', 'Unknown')
+            self.user_name_map = dict(zip(account_df['id'].astype(str), account_df['name'].fillna('Unknown')))
 
         # Create users list
         self.users = self.create_users()
@@ -333,26 +422,24 @@ class UserManager:
     def create_users(self):
         """Create User list from KRs data, only for users in account."""
         users = {}
-        unique_user_ids = set()
 
-        if not self.krs_df.empty and 'user_id' in self.krs_df.columns:
-            for _, kr in self.krs_df.iterrows():
-                user_id = str(kr.get("user_id"))
-                if user_id and user_id not in unique_user_ids and user_id in self.user_name_map:
-                    name = self.user_name_map[user_id]
-                    users[user_id] = User(user_id, name)
-                    unique_user_ids.add(user_id)
+        for user_id in self.krs_df.index.unique():
+            if user_id in self.user_name_map:
+                users[user_id] = User(user_id, self.user_name_map[user_id])
 
         return users
 
     def update_checkins(self, start_date=None, end_date=None):
         """Check and update check-in status for each user."""
-        for user in self.users.values():
-            if self.has_weekly_checkins(user.user_id, start_date, end_date):
+        weekly_checkins = self.count_weekly_checkins(start_date, end_date)
+        qualifying_users = set(weekly_checkins[weekly_checkins >= 3].index)
+        
+        for user_id, user in self.users.items():
+            if user_id in qualifying_users:
                 user.checkin = 1
     
-    def has_weekly_checkins(self, user_id, start_date=None, end_date=None):
-        """Kiểm tra xem user có check-in ít nhất 3 tuần trong khoảng thời gian đã chỉ định không."""
+    def count_weekly_checkins(self, start_date=None, end_date=None):
+        """Đếm số tuần có check-in của mỗi user trong khoảng thời gian đã chỉ định (user_id → số tuần)."""
         # Set default date range if not provided
         if start_date is None:
             start_date = get_current_quarter_start()
@@ -363,41 +450,58 @@ class UserManager:
         start_datetime = datetime.combine(start_date, datetime.min.time()).replace(tzinfo=timezone.utc)
         end_datetime = datetime.combine(end_date, datetime.max.time()).replace(tzinfo=timezone.utc)
         
-        checkins = []
+        if self.checkin_df.empty:
+            return pd.Series(dtype='int64')
         
-        # Thu thập tất cả các lần check-in của user từ checkin_df
-        if not self.checkin_df.empty and 'user_id' in self.checkin_df.columns and 'day' in self.checkin_df.columns:
-            user_checkins = self.checkin_df[self.checkin_df['user_id'].astype(str) == str(user_id)]
-            
-            for _, entry in user_checkins.iterrows():
-                checkin_date = datetime.fromtimestamp(float(entry.get('day')), tz=timezone.utc)
-                checkins.append(checkin_date)
+        checkins = self.checkin_df['checkin_time']
         
         # Lọc ra các lần check-in trong khoảng thời gian đã chỉ định
-        checkins_in_range = [dt for dt in checkins if start_datetime <= dt <= end_datetime]
+        in_range = (checkins >= start_datetime) & (checkins <= end_datetime)
+        weeks = checkins[in_range].dt.isocalendar().week
         
-        if not checkins_in_range:
-            return False  # Không có check-in nào trong khoảng thời gian -> False
+        # Đếm số tuần có check-in của từng user
+        return weeks.groupby(level='user_id').nunique()
+    
+    def calculate_scores(self):
+        """Calculate score for all users at once based on criteria: check-in, OKR and OKR movement."""
+        users = self.get_users()
         
-        # Lưu số tuần có check-in
-        weekly_checkins = set(dt.isocalendar()[1] for dt in checkins_in_range)
+        checkin = np.array([user.checkin for user in users], dtype=np.float64)
+        co_OKR = np.array([user.co_OKR for user in users], dtype=np.float64)
+        movement = np.array([user.dich_chuyen_OKR for user in users], dtype=np.float64)
         
-        # Kiểm tra xem user đã check-in ít nhất 3 tuần trong khoảng thời gian chưa
-        return len(weekly_checkins) >= 3
-
-    def calculate_scores(self):
-        """Calculate score for all users."""
-        for user in self.users.values():
-            user.calculate_score()
+        # OKR movement score
+        buckets = np.searchsorted(MOVEMENT_EDGES, movement, side='right')
+        movement_scores = MOVEMENT_SCORES[buckets]
+        movement_rows = MOVEMENT_ROWS[buckets]
+        
+        # Base 0.5, check-in contributes 0.5, having OKR contributes 1, rounded to 2 decimal places
+        scores = np.round(0.5 + 0.5 * (checkin == 1) + 1.0 * (co_OKR == 1) + movement_scores, 2)
+        
+        for user, score, movement_score, movement_row in zip(users, scores, movement_scores, movement_rows):
+            user.score = float(score)
+            user.movement_score = float(movement_score)
+            user.movement_row = int(movement_row)
 
     def get_users(self):
         """Return list of all users."""
         return list(self.users.values())
 
+    def to_frame(self):
+        """Return one DataFrame of all users with numeric columns, reused for metrics and display."""
+        return pd.DataFrame(
+            [(user.user_id, user.name, user.co_OKR, user.checkin, user.dich_chuyen_OKR, user.score)
+             for user in self.users.values()],
+            columns=["user_id", "name", "co_OKR", "checkin", "dich_chuyen_OKR", "score"]
+        )
+
     def update_okr_movement(self):
-        """Update OKR movement for each user."""
+        """Update OKR movement for each user.
+
+        Returns False if previous month OKR could not be read, so movement is unknown.
+        """
         if self.cycle_df is None or self.cycle_df.empty:
-            return
+            return True
 
         avg_goals = self.calculate_avg_goals()
         
@@ -413,132 +517,165 @@ class UserManager:
             prev_month = current_month - 1
             prev_year = current_year
 
+        # At the start of a quarter (month 1, 4, 7, 10) OKR is kept as is, so previous month is not needed
+        is_quarter_start = current_month in (1, 4, 7, 10)
+
+        # Get OKR values for previous month from Google Sheets in one request
+        prev_okrs = {} if is_quarter_start else self.bulk_get_okr(list(self.users.keys()), prev_year, prev_month)
+        # If reading failed, missing rows cannot be told apart from a failed read:
+        # movement is unknown and no zero rows are inserted, but current month values are still written
+        read_failed = prev_okrs is None
+
+        missing_records = []
+        records = []
+
         for user in self.users.values():
             user_id = user.user_id
             
             # Get current OKR value from calculations
             current_okr = avg_goals.get(user_id, 0)
             
-            # Get OKR value for previous month from Google Sheets
-            prev_okr = self.get_okr_from_sheets(user_id, prev_year, prev_month)
-            if prev_okr is None:
-                prev_okr = 0
-                # Add new data to Google Sheets
-                self.insert_okr_to_sheets(user_id, prev_year, prev_month, 0)
-            
-            # If current month is 1, 4, 7, 10 then keep OKR as is
-            if current_month in [1, 4, 7, 10]:
+            if is_quarter_start:
                 user.dich_chuyen_OKR = current_okr
-            else:
+            elif not read_failed:
+                prev_okr = prev_okrs.get(user_id)
+                if prev_okr is None:
+                    prev_okr = 0
+                    # Add new data to Google Sheets (insert only, never overwrites an existing row)
+                    missing_records.append(self.okr_record(user_id, prev_year, prev_month, 0))
+                
                 # Calculate OKR change
                 user.dich_chuyen_OKR = round(current_okr - prev_okr, 2)
                 
             # Update Google Sheets with current OKR value
-            self.update_okr_to_sheets(user_id, current_year, current_month, current_okr)
+            records.append(self.okr_record(user_id, current_year, current_month, current_okr))
+
+        # Write all OKR values to Google Sheets, one request per action
+        self.bulk_insert_okr(missing_records)
+        self.bulk_upsert_okr(records)
+
+        return not read_failed
 
     def calculate_avg_goals(self):
         """Calculate average OKR for each user using real-time data"""
-        goals_data = defaultdict(list)
-
-        if not self.cycle_df.empty and 'type' in self.cycle_df.columns and 'user_id' in self.cycle_df.columns:
-            goals_df = self.cycle_df[self.cycle_df['type'] == 'goals']
-            for _, goal in goals_df.iterrows():
-                user_id = str(goal.get("user_id"))
-                current_value = float(goal.get("current_value", 0))
-                goals_data[user_id].append(current_value)
-
-        # Calculate average values
-        avg_goals = {
-            user: sum(values) / len(values) if values else 0
-            for user, values in goals_data.items()
-        }
+        if self.cycle_df.empty or 'type' not in self.cycle_df.columns or 'user_id' not in self.cycle_df.columns:
+            return {}
+
+        # Only take the columns needed instead of copying every column of the goal rows
+        is_goal = self.cycle_df['type'].eq('goals')
+        user_ids = self.cycle_df.loc[is_goal, 'user_id'].astype(str)
+        if 'current_value' in self.cycle_df.columns:
+            current_values = pd.to_numeric(self.cycle_df.loc[is_goal, 'current_value'], errors='coerce').fillna(0)
+        else:
+            current_values = pd.Series(0.0, index=user_ids.index)
+
+        # Calculate average values in a single groupby pass
+        avg_goals = current_values.groupby(user_ids).mean().to_dict()
 
         return avg_goals
 
-    def get_okr_from_sheets(self, user_id, year, month):
-        """Get OKR value from Google Sheets"""
-        params = {
-            "action": "get",
+    @staticmethod
+    def okr_record(user_id, year, month, okr_value):
+        """Build a Google Sheets OKR record."""
+        return {
             "user_id": user_id,
             "year": year,
-            "month": month
+            "month": month,
+            "okr_value": okr_value
+        }
+
+    def bulk_get_okr(self, user_ids, year, month):
+        """Get OKR values of many users from Google Sheets.
+
+        Returns user_id → value (None if the row is missing), or None if the read failed.
+        """
+        data = {
+            "action": "get_bulk",
+            "keys": [{"user_id": user_id, "year": year, "month": month} for user_id in user_ids]
         }
         try:
-            response = requests.get(GOOGLE_SHEETS_API_URL, params=params)
-            data = response.json()
+            response = SESSION.post(GOOGLE_SHEETS_API_URL, json=data, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            json_response = response.json()
+            
+            if "error" in json_response:
+                st.warning(f"Error getting OKR from sheets: {json_response['error']}")
+                return None
+            if "okr_values" not in json_response:
+                st.warning("Error getting OKR from sheets: response has no 'okr_values' (is the get_bulk action deployed?)")
+                return None
             
-            # Check if no data, return None
-            okr_value = data.get("okr_value")
-            if okr_value is None:
-                return None  # Return None to indicate data doesn't exist
-            return float(okr_value)
+            return {
+                str(user_id): None if okr_value is None else float(okr_value)
+                for user_id, okr_value in json_response["okr_values"].items()
+            }
         except Exception as e:
             st.warning(f"Error getting OKR from sheets: {e}")
             return None
 
-    def insert_okr_to_sheets(self, user_id, year, month, okr_value=0):
-        """Add OKR data to Google Sheets if it doesn't exist"""
+    def bulk_insert_okr(self, records):
+        """Add many OKR records to Google Sheets, skipping rows that already exist"""
+        if not records:
+            return None
+        
         data = {
-            "action": "insert",
-            "user_id": user_id,
-            "year": year,
-            "month": month,
-            "okr_value": okr_value
+            "action": "insert_bulk",
+            "records": records
         }
         try:
-            response = requests.post(GOOGLE_SHEETS_API_URL, json=data)
+            response = SESSION.post(GOOGLE_SHEETS_API_URL, json=data, timeout=REQUEST_TIMEOUT)
             return response.text
         except Exception as e:
             st.warning(f"Error inserting OKR to sheets: {e}")
             return None
 
-    def update_okr_to_sheets(self, user_id, year, month, okr_value):
-        """Update OKR data in Google Sheets"""
-        # Check if record exists
-        existing_value = self.get_okr_from_sheets(user_id, year, month)
+    def bulk_upsert_okr(self, records):
+        """Insert or update many OKR records in Google Sheets"""
+        if not records:
+            return None
         
-        if existing_value is None:
-            # Insert new record
-            data = {
-                "action": "insert",
-                "user_id": user_id,
-                "year": year,
-                "month": month,
-                "okr_value": okr_value
-            }
-        else:
-            # Update existing record
-            data = {
-                "action": "update",
-                "user_id": user_id,
-                "year": year,
-                "month": month,
-                "okr_value": okr_value
-            }
-            
+        data = {
+            "action": "upsert_bulk",
+            "records": records
+        }
         try:
-            response = requests.post(GOOGLE_SHEETS_API_URL, json=data)
+            response = SESSION.post(GOOGLE_SHEETS_API_URL, json=data, timeout=REQUEST_TIMEOUT)
             return response.text
         except Exception as e:
             st.warning(f"Error updating OKR to sheets: {e}")
             return None
 
-# Function to generate data table
-def generate_data_table(users):
-    # Create a DataFrame from users
-    data = []
-    for user in users:
-        data.append({
-            "Name": user.name,
-            "Has OKR": "Yes" if user.co_OKR == 1 else "No",
-            "Check-in": "Yes" if user.checkin == 1 else "No",
-            "OKR Movement": user.dich_chuyen_OKR,
-            "Score": user.score
-        })
-    
-    df = pd.DataFrame(data)
+# Function to generate data table, cached on the users DataFrame stored in session state
+@st.cache_data(ttl=CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES, show_spinner=False)
+def generate_data_table(users_df):
+    # Sort by score descending and rename columns for display
+    df = users_df.sort_values(by="score", ascending=False)[["name", "co_OKR", "checkin", "dich_chuyen_OKR", "score"]]
+    df = df.rename(columns={
+        "name": "Name",
+        "co_OKR": "Has OKR",
+        "checkin": "Check-in",
+        "dich_chuyen_OKR": "OKR Movement",
+        "score": "Score"
+    })
     return df
 
+def yes_no(value):
+    return "Yes" if value == 1 else "No"
+
+# Show 1/0 flags as Yes/No without changing the underlying numeric columns
+# (a Styler cannot be pickled by st.cache_data, so it is applied outside the cached table)
+def style_data_table(df):
+    return df.style.format({"Has OKR": yes_no, "Check-in": yes_no}, precision=2)
+
+# Excel styles, created once and shared by reference across all cells
+HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+CATEGORY_FILL = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+CATEGORY_FONT = Font(bold=True)
+TITLE_FONT = Font(size=14, bold=True)
+CENTER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+THIN_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
+
 # Add this function to your file
 def export_to_excel(users, filename="output1.xlsx"):
     """
@@ -547,45 +684,24 @@ def export_to_excel(users, filename="output1.xlsx"):
     Yêu cầu:
       - Mỗi user phải có các thuộc tính: name, co_OKR, checkin, dich_chuyen_OKR, score
     """
-    # Tạo workbook và sheet
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "OKRs"
-
-    # Định nghĩa style
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    category_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    category_font = Font(bold=True)
-    thin_border = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
-
-    # --- Tiêu đề chính ---
-    total_columns = 3 + len(users)  # 3 cột cố định + số user
-    last_col_letter = get_column_letter(total_columns)
-    ws.merge_cells(f"A1:{last_col_letter}1")
-    title_cell = ws["A1"]
-    title_cell.value = "ĐÁNH GIÁ OKRs THÁNG"
-    title_cell.font = Font(size=14, bold=True)
-    title_cell.alignment = Alignment(horizontal="center", vertical="center")
+    # Tạo workbook và sheet ở chế độ write-only (ghi tuần tự từng dòng)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("OKRs")
+
+    def styled_cell(value, font=None, fill=None):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.alignment = CENTER_ALIGNMENT
+        cell.border = THIN_BORDER
+        if font is not None:
+            cell.font = font
+        if fill is not None:
+            cell.fill = fill
+        return cell
 
     # --- Header (dòng 2) ---
     fixed_headers = ["TT", "Nội dung", "Tự chấm điểm"]
     user_headers = [user.name for user in users]
     headers = fixed_headers + user_headers
-    for col_idx, header in enumerate(headers, start=1):
-        cell = ws.cell(row=2, column=col_idx, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = thin_border
-        # Đặt độ rộng mặc định cho các cột
-        col_letter = get_column_letter(col_idx)
-        if col_idx == 2:
-            ws.column_dimensions[col_letter].width = 70  # Nội dung dài hơn
-        elif col_idx == 1:
-            ws.column_dimensions[col_letter].width = 5
-        else:
-            ws.column_dimensions[col_letter].width = 15
 
     # --- Các dòng tiêu chí (bắt đầu từ dòng 3) ---
     criteria = [
@@ -603,95 +719,83 @@ def export_to_excel(users, filename="output1.xlsx"):
         [5, "Tổng cộng OKRs", ""]
     ]
     start_row = 3
+
+    # --- Dữ liệu của từng user theo dòng ---
+    user_columns = [
+        {
+            3: 1 if user.co_OKR == 1 else 0,  # 1. Đánh giá OKRs cá nhân
+            4: 0.5 if user.checkin == 1 else 0,  # 2. Check-in hàng tuần
+            5: 0.5,  # 3. Check-in với người khác
+            6: f"{user.dich_chuyen_OKR}%",  # 4. % dịch chuyển OKR
+            user.movement_row: user.movement_score,  # Điểm dịch chuyển (dòng 7 - 13)
+            14: user.score  # 5. Tổng điểm
+        }
+        for user in users
+    ]
+
+    # --- Độ rộng cột và freeze panes phải đặt trước khi ghi dòng đầu tiên ---
+    # Độ rộng cột được tính trực tiếp từ header, tiêu chí và dữ liệu user
+    max_width = defaultdict(int)
+    for col_idx, header in enumerate(headers, start=1):
+        max_width[col_idx] = len(str(header))
+    for row_data in criteria:
+        for col_idx, value in enumerate(row_data, start=1):
+            max_width[col_idx] = max(max_width[col_idx], len(str(value)))
+    for col_idx, column in enumerate(user_columns, start=4):
+        for value in column.values():
+            max_width[col_idx] = max(max_width[col_idx], len(str(value)))
+
+    for col_idx, width in max_width.items():
+        ws.column_dimensions[get_column_letter(col_idx)].width = width + 2
+    ws.freeze_panes = "D3"
+
+    # --- Tiêu đề chính ---
+    total_columns = 3 + len(users)  # 3 cột cố định + số user
+    last_col_letter = get_column_letter(total_columns)
+    ws.merged_cells.add(f"A1:{last_col_letter}1")
+    title_cell = WriteOnlyCell(ws, value="ĐÁNH GIÁ OKRs THÁNG")
+    title_cell.font = TITLE_FONT
+    title_cell.alignment = CENTER_ALIGNMENT
+    ws.append([title_cell])
+
+    ws.append([styled_cell(header, HEADER_FONT, HEADER_FILL) for header in headers])
+
     for i, row_data in enumerate(criteria):
         row_idx = start_row + i
+        row = []
         for col_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.border = thin_border
             # Đánh dấu cột loại (nếu giá trị đầu tiên là số thứ tự) với màu nền và in đậm
             if col_idx == 1 and isinstance(value, int):
-                cell.fill = category_fill
-                cell.font = category_font
-
-    # --- Ghi dữ liệu của từng user ---
-    # Các user sẽ được hiển thị từ cột 4 trở đi
-    for idx, user in enumerate(users, start=1):
-        col_idx = 3 + idx  # cột thứ 1-3 đã dành cho tiêu đề cố định
-        col_letter = get_column_letter(col_idx)
-        # 1. Đánh giá OKRs cá nhân (dòng 3)
-        ws.cell(row=3, column=col_idx, value=1 if user.co_OKR == 1 else 0)
-        # 2. Check-in hàng tuần (dòng 4)
-        ws.cell(row=4, column=col_idx, value=0.5 if user.checkin == 1 else 0)
-        # 3. Check-in với người khác (dòng 5)
-        ws.cell(row=5, column=col_idx, value=0.5 )
-
-        # 4. Dịch chuyển OKR:
-        # Dòng 6 hiển thị % dịch chuyển, các dòng từ 7 đến 13 hiển thị điểm tương ứng
-        movement = user.dich_chuyen_OKR
-        ws.cell(row=6, column=col_idx, value=f"{movement}%")
-
-        # Xác định điểm dịch chuyển dựa theo % và dòng ghi điểm:
-        if movement < 10:
-            score_value = 0.15
-            movement_row = 7
-        elif movement < 26:
-            score_value = 0.25
-            movement_row = 8
-        elif movement < 31:
-            score_value = 0.5
-            movement_row = 9
-        elif movement < 51:
-            score_value = 0.75
-            movement_row = 10
-        elif movement < 81:
-            score_value = 1.25
-            movement_row = 11
-        elif movement < 100:
-            score_value = 1.5
-            movement_row = 12
-        else:
-            score_value = 2.5
-            movement_row = 13
-        ws.cell(row=movement_row, column=col_idx, value=score_value)
-
-        # 5. Tổng điểm: sử dụng công thức SUM từ dòng 3 đến dòng 13
-        formula = user.score
-        ws.cell(row=14, column=col_idx, value=formula)
-
-        # Áp dụng border và căn giữa cho các ô dữ liệu của user
-        for r in range(3, 15):
-            cell = ws.cell(row=r, column=col_idx)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.border = thin_border
-
-    # --- Freeze panes để cố định header và tiêu chí ---
-    ws.freeze_panes = ws["D3"]
-
-    # --- Tự động điều chỉnh độ rộng cột (nếu cần) ---
-    # Vòng lặp qua các cột để tính độ rộng dựa trên nội dung
-    for col in ws.columns:
-        max_length = 0
-        col_letter = get_column_letter(col[0].column)
-        for cell in col:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
-        adjusted_width = max_length + 2
-        ws.column_dimensions[col_letter].width = adjusted_width
+                row.append(styled_cell(value, CATEGORY_FONT, CATEGORY_FILL))
+            else:
+                row.append(styled_cell(value))
+        # Các user sẽ được hiển thị từ cột 4 trở đi
+        row.extend(styled_cell(column.get(row_idx)) for column in user_columns)
+        ws.append(row)
 
     # Return the workbook object
     return wb
 
 
+# Serialize the Excel export, cached on the users DataFrame (_users is not hashed)
+@st.cache_data(ttl=CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES, show_spinner=False)
+def export_to_excel_bytes(users_df, _users):
+    excel_wb = export_to_excel(_users)
+    
+    # Save the workbook to a BytesIO object
+    excel_buffer = io.BytesIO()
+    excel_wb.save(excel_buffer)
+    return excel_buffer.getvalue()
+
 # Function to display user metrics
-def display_user_metrics(users):
+def display_user_metrics(users_df):
     # Create metrics
     col1, col2, col3, col4 = st.columns(4)
     
-    total_users = len(users)
-    users_with_checkins = sum(1 for user in users if user.checkin == 1)
-    users_with_okr = sum(1 for user in users if user.co_OKR == 1)
-    avg_score = sum(user.score for user in users) / total_users if total_users > 0 else 0
+    total_users = len(users_df)
+    users_with_checkins = int(users_df["checkin"].eq(1).sum())
+    users_with_okr = int(users_df["co_OKR"].eq(1).sum())
+    avg_score = users_df["score"].mean() if total_users > 0 else 0
     
     with col1:
         st.metric("Total Users", total_users)
@@ -763,8 +867,11 @@ def main():
                 # Update check-ins with date range
                 manager.update_checkins(start_date, end_date)
                 
-                # Update OKR movement
-                manager.update_okr_movement()
+                # Update OKR movement; scores without it would not be valid
+                if not manager.update_okr_movement():
+                    st.session_state.calculate_clicked = False
+                    st.error("Could not read previous month OKR from Google Sheets, so OKR movement and scores are unavailable. Please try again.")
+                    return
                 
                 # Calculate scores
                 manager.calculate_scores()
@@ -772,8 +879,9 @@ def main():
                 # Get users
                 users = manager.get_users()
                 
-                # Store users and date range in session state
+                # Store users, their DataFrame and date range in session state
                 st.session_state.users = users
+                st.session_state.users_df = manager.to_frame()
                 st.session_state.date_range = (start_date, end_date)
                 
                 st.success("Scores calculated successfully!")
@@ -781,7 +889,7 @@ def main():
                 st.error("Error fetching data. Please try again.")
         
         # Display results if calculation was done
-        if hasattr(st.session_state, 'calculate_clicked') and st.session_state.calculate_clicked and hasattr(st.session_state, 'users'):
+        if hasattr(st.session_state, 'calculate_clicked') and st.session_state.calculate_clicked and hasattr(st.session_state, 'users') and hasattr(st.session_state, 'users_df'):
             st.markdown("<h2 class='sub-header'>OKR Scoring Results</h2>", unsafe_allow_html=True)
               # Display the date range used for calculation
             if hasattr(st.session_state, 'date_range'):
@@ -790,23 +898,15 @@ def main():
                     st.info(f"📅 Check-ins analyzed from **{start_str.strftime('%d/%m/%Y')}** to **{end_str.strftime('%d/%m/%Y')}**")
             
             # Display metrics
-            display_user_metrics(st.session_state.users)
-            
-            # Display data table
-            df = generate_data_table(st.session_state.users)
+            display_user_metrics(st.session_state.users_df)
             
-            # Sort by score descending
-            df = df.sort_values(by="Score", ascending=False)            # Apply styling
+            # Display data table sorted by score descending
+            styled_df = style_data_table(generate_data_table(st.session_state.users_df))
             st.markdown("<h3 class='sub-header'>User Scores</h3>", unsafe_allow_html=True)
-            st.dataframe(df, use_container_width=True)
+            st.dataframe(styled_df, use_container_width=True)
             
             # New Excel download button
-            excel_wb = export_to_excel(st.session_state.users)
-            
-            # Save the workbook to a BytesIO object
-            excel_buffer = io.BytesIO()
-            excel_wb.save(excel_buffer)
-            excel_data = excel_buffer.getvalue()
+            excel_data = export_to_excel_bytes(st.session_state.users_df, st.session_state.users)
             
             st.download_button(
                 "Download Excel",